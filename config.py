@@ -1,12 +1,24 @@
 import yaml
 from typing import List
 import date_utils
+import file_cache
 from filter import FilterCond
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+# Keys of the raw config that Config parses itself
+_PARSED_KEYS = frozenset(("start", "end", "path", "filter", "today"))
+
 
 class Config:
     name: str
 
+    # Other keys of the raw config are set as attributes too
+    __slots__ = ("__dict__", "start", "end", "path", "filter")
+
     def __init__(self, raw_config: dict, path: str) -> None:
         self.start = date_utils.parse_date_str(raw_config["start"])
         self.end = date_utils.parse_date_str(raw_config["end"], self.start)
@@ -17,9 +29,9 @@ class Config:
         if "today" in raw_config:
             self.today = date_utils.parse_date_str(raw_config["today"])
 
-        for key, value in raw_config.items():
-            if not hasattr(self, key):
-                setattr(self, key, value)
+        self.__dict__.update(
+            (key, value) for key, value in raw_config.items()
+            if key not in _PARSED_KEYS)
 
     def __str__(self) -> str:
         return f"{self.name} ({self.start} - {self.end})"
@@ -38,13 +50,15 @@ class ConfigDB:
 
     def load(self, path: str) -> None:
         self.files.append(path)
+        self.configs += file_cache.load(path, self._parse)
 
+    @staticmethod
+    def _parse(path: str) -> List[Config]:
         # Read file and parse configs
         with open(path, "r") as f:
-            configs = yaml.safe_load(f)
+            configs = yaml.load(f, Loader=_YamlLoader)
         try:
-            for c in configs:
-                self.configs.append(Config(c, path))
+            return [Config(c, path) for c in configs]
         except Exception as e:
             print(f"== Error when loading configs file {path} ==")
             raise e
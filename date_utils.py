@@ -1,34 +1,50 @@
+import calendar
 import datetime
-import math
+import functools
 import re
 
+_DELTA_RE = re.compile(r"([+-])(\d+)([dwmy])+")
+
+_DAY_DELTAS = tuple(datetime.timedelta(days=i) for i in range(7))
+
+_SEP_TRANS = str.maketrans(",-/", "   ")
+
+_MONTH_ABBRS = {m.lower(): i for i, m in enumerate(calendar.month_abbr) if m}
+
+_DATE_RE = re.compile(
+    r"(?P<b1>[a-z]{3})\s+(?P<d1>\d{1,2})(?:\s+(?P<y1>\d{4}))?"  # e.g. May 4 2023
+    r"|(?P<m2>\d{1,2})\s+(?P<d2>\d{1,2})\s+(?P<y2>\d{4})"  # e.g. 05/04/2023
+    r"|(?P<y3>\d{4})\s+(?:(?P<b3>[a-z]{3})|(?P<m3>\d{1,2}))\s+(?P<d3>\d{1,2})",
+    re.IGNORECASE | re.ASCII)  # e.g. 2023 May 4, 2023/05/04
+
 
 def next_month_day(since: datetime.date, month: int, day: int) -> datetime.date:
     year = since.year
-    while True:
-        try:
-            date = datetime.datetime(year, month, day).date()
-            if date >= since:
-                return date
-        except ValueError:
-            pass
+    if month == 2 and day == 29:
+        while not calendar.isleap(year) or datetime.date(year, 2, 29) < since:
+            year += 1
+    elif (month, day) < (since.month, since.day):
         year += 1
+    return datetime.date(year, month, day)
 
 
 def next_weekday(since: datetime.date, weekday: int) -> datetime.date:
-    days = (weekday + 7 - since.weekday()) % 7
-    return since + datetime.timedelta(days=days)
+    return since + _DAY_DELTAS[(weekday + 7 - since.weekday()) % 7]
 
 
 def _parse_delta(base: datetime.date, sign, number, unit) -> datetime.date:
     if unit == "d":
-        return base + datetime.timedelta(days=number) * sign
+        if number < len(_DAY_DELTAS):
+            delta = _DAY_DELTAS[number]
+            return base + delta if sign > 0 else base - delta
+        return base + datetime.timedelta(days=number * sign)
     elif unit == "w":
-        return base + datetime.timedelta(weeks=number) * sign
+        return base + datetime.timedelta(weeks=number * sign)
     else:
         if unit == "m":
-            new_year = math.floor(number / 12) + base.year
-            new_month = number % 12 + base.month
+            years, months = divmod(number, 12)
+            new_year = years + base.year
+            new_month = months + base.month
         else:  # "y"
             new_year = number + base.year
             new_month = base.month
@@ -39,7 +55,10 @@ def _parse_delta(base: datetime.date, sign, number, unit) -> datetime.date:
         compensate = 0  # Handle months with 31 days -> 30/29/28
         while compensate <= 3:
             try:
-                date_base = base + datetime.timedelta(days=-compensate) * sign
+                if sign > 0:
+                    date_base = base - _DAY_DELTAS[compensate]
+                else:
+                    date_base = base + _DAY_DELTAS[compensate]
                 return date_base.replace(year=new_year, month=new_month)
             except ValueError:
                 pass
@@ -47,14 +66,15 @@ def _parse_delta(base: datetime.date, sign, number, unit) -> datetime.date:
 
 
 def parse_delta(base: datetime.date, delta_str: str):
-    if not re.match(r"([+-])(\d+)([dwmy])+", delta_str.lower()):
+    delta_str = delta_str.lower()
+    if not _DELTA_RE.match(delta_str):
         return None
 
     date = base
     if date is None:
         date = datetime.date.today()
 
-    matches = re.findall(r"([+-])(\d+)([dwmy])+", delta_str.lower())
+    matches = _DELTA_RE.findall(delta_str)
     for parts in matches:
         sign = -1 if parts[0] == "-" else 1
         number = int(parts[1])
@@ -64,13 +84,8 @@ def parse_delta(base: datetime.date, delta_str: str):
 
 
 def parse_date(last_date: datetime.date, date_str: str) -> datetime.date:
-    # Replace comma
-    seps = [",", "-", "/"]
-    formatted_str = date_str
-    for sep in seps:
-        formatted_str = formatted_str.replace(sep, " ")
-    # Remove extra whitespaces
-    formatted_str = " ".join(formatted_str.split())
+    # Replace separators, any whitespace is split on below
+    formatted_str = date_str.translate(_SEP_TRANS).strip()
 
     if last_date is None:
         # Set the end of last year as the last date
@@ -78,36 +93,56 @@ def parse_date(last_date: datetime.date, date_str: str) -> datetime.date:
             year=datetime.date.today().year, month=1, day=1)
         last_date -= datetime.timedelta(days=1)
 
-    # e.g. May 04
+    parts = formatted_str.split()
+    if len(parts) == 2 and parts[0].isalpha() and len(parts[1]) <= 2 and \
+            parts[1].isascii() and parts[1].isdigit():
+        # e.g. May 04, the most common format, split without _DATE_RE
+        year, month, day = None, parts[0], int(parts[1])
+    else:
+        # _DATE_RE only knows ASCII whitespace, rejoin on unicode-aware split
+        m = _DATE_RE.fullmatch(" ".join(parts))
+        if m is None:
+            return None
+
+        year = m["y1"] or m["y2"] or m["y3"]
+        month = m["b1"] or m["m2"] or m["b3"] or m["m3"]
+        day = int(m["d1"] or m["d2"] or m["d3"])
+
+    if month.isdigit():
+        month = int(month)
+    else:
+        month = _MONTH_ABBRS.get(month.lower())
+        if month is None:
+            return None
+
     try:
-        date = datetime.datetime.strptime(formatted_str, "%b %d").date()
-        return next_month_day(last_date, date.month, date.day)
+        if year is None:
+            # e.g. May 04, validated against a leap year to accept Feb 29
+            datetime.date(2000, month, day)
+            return next_month_day(last_date, month, day)
+        return datetime.date(int(year), month, day)
     except ValueError:
-        # Handle Feb 29
-        if formatted_str == "Feb 29":
-            return next_month_day(last_date, 2, 29)
+        return None
 
-    format_strs = [
-        "%b %d %Y",  # e.g. May 4, 2023
-        "%m %d %Y",  # e.g. 05/04/2023
-        "%Y %b %d",  # e.g. 2023 May 4
-        "%Y %m %d",  # e.g. 2023/05/04
-    ]
-    for format_str in format_strs:
-        try:
-            return datetime.datetime.strptime(formatted_str, format_str).date()
-        except ValueError:
-            pass
 
-    return None
+def parse_date_str(date_str: str, last_date: datetime.date = None) -> datetime.date:
+    # Default dates depend on today, so it is part of the cache key
+    return _parse_date_str(date_str, last_date, datetime.date.today())
 
 
-def parse_date_str(date_str: str, last_date: datetime.date = None) -> datetime.date:
+@functools.lru_cache(maxsize=4096)
+def _parse_date_str(date_str: str, last_date: datetime.date,
+                    today: datetime.date) -> datetime.date:
     # e.g. +5d, +4w, +2m
-    date = parse_delta(last_date, date_str)
+    date = parse_delta(today if last_date is None else last_date, date_str)
     if date:
         return date
 
+    if last_date is None:
+        # Set the end of last year as the last date
+        last_date = datetime.date(year=today.year, month=1, day=1)
+        last_date -= datetime.timedelta(days=1)
+
     date = parse_date(last_date, date_str)
     if date:
         return date
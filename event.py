@@ -1,12 +1,27 @@
-from typing import List, Tuple, Dict
+from typing import List, Optional, Tuple, Dict, Set
+from collections import defaultdict
+import numpy as np
 import yaml
 import datetime
 import os
+import sys
 import date_utils
+import file_cache
 from config import FilterCond
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+
+def _get_track_tag(path: str) -> str:
+    # Every event is tagged with the track (file) it comes from
+    return sys.intern(f"@{os.path.splitext(os.path.basename(path))[0]}")
+
 
 class EventTime:
+    __slots__ = ("start", "end", "date", "raw_time", "_start", "_end", "_str")
 
     def __init__(self, time, last_date: datetime.date) -> None:
         self.start = None
@@ -34,31 +49,33 @@ class EventTime:
         else:
             raise TypeError(f"Unknown event time: {time}")
 
+        # Hot in sorting and filtering, so resolve once
+        self._start = self.date if self.start is None else self.start
+        self._end = self.date if self.end is None else self.end
+        if self.start is not None:
+            self._str = f"{self.start} - {self.end}"
+        else:
+            self._str = f"{self.date}"
+
     def _sanity_check(self) -> None:
         assert (self.start is None) == (self.end is None)
         assert (self.start is None) != (self.date is None)
 
     def isPeriod(self) -> bool:
-        self._sanity_check()
+        if __debug__:
+            self._sanity_check()
         return self.start is not None
 
     def isTime(self) -> bool:
-        self._sanity_check()
+        if __debug__:
+            self._sanity_check()
         return self.date is not None
 
     def getStartTime(self) -> datetime.date:
-        self._sanity_check()
-        if self.isPeriod():
-            return self.start
-        else:
-            return self.date
+        return self._start
 
     def getEndTime(self) -> datetime.date:
-        self._sanity_check()
-        if self.isPeriod():
-            return self.end
-        else:
-            return self.date
+        return self._end
 
     def date_in_bound(self, start: datetime.date, end: datetime.date) -> bool:
         assert start < end
@@ -71,10 +88,7 @@ class EventTime:
         return max(self.getStartTime(), start), min(self.getEndTime(), end)
 
     def __str__(self) -> str:
-        if self.isPeriod():
-            return f"{self.start} - {self.end}"
-        else:
-            return f"{self.date}"
+        return self._str
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -87,7 +101,11 @@ class Event:
     file: str
     time: EventTime
 
-    def __init__(self, raw_event: dict, file: str, last_date: datetime.date = None) -> None:
+    __slots__ = ("name", "description", "tags", "file", "time", "_tag_set",
+                 "_sorted_tags_str")
+
+    def __init__(self, raw_event: dict, file: str, last_date: datetime.date = None,
+                 track_tag: str = None) -> None:
         assert "name" in raw_event, f"Event w/o name in file {file}"
         self.name = raw_event["name"]
 
@@ -97,10 +115,12 @@ class Event:
 
         self.tags = []
         if "tags" in raw_event:
-            self.tags = [f"#{t}" for t in raw_event["tags"]]
+            self.tags = [sys.intern(f"#{t}") for t in raw_event["tags"]]
 
         self.file = file
-        self.tags.append(f"@{os.path.splitext(os.path.basename(file))[0]}")
+        if track_tag is None:
+            track_tag = _get_track_tag(file)
+        self.tags.append(track_tag)
 
         assert "time" in raw_event, f"Event w/o time in file {file}"
         self.time = EventTime(raw_event["time"], last_date)
@@ -108,11 +128,13 @@ class Event:
             self.tags.append(f"#period")
         else:
             self.tags.append(f"#date")
+        self._tag_set = frozenset(self.tags)
+        self._sorted_tags_str = " ".join(sorted(self.tags))
 
     def filter_tags(self, tags: List[str]) -> List[str]:
         # Return a list of tags that match with this event
         assert isinstance(tags, list)
-        return list(set(self.tags).intersection(set(tags)))
+        return list(self._tag_set.intersection(tags))
 
     def get_track(self) -> str:
         for tag in self.tags:
@@ -121,7 +143,7 @@ class Event:
         return None
 
     def __str__(self) -> str:
-        return f"{self.name} ({self.time}) [{' '.join(sorted(self.tags))}]"
+        return f"{self.name} ({self.time}) [{self._sorted_tags_str}]"
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -137,45 +159,114 @@ class EventDB:
         self.events = []
         self.track_names = {}
 
+        # Indexes over self.events, built lazily by filter() and __str__
+        self._indexed_events = None
+        self._by_tag = None
+        self._start_ords = None
+        self._end_ords = None
+        self._by_start = None
+
     def load(self, path: str, update: bool = False) -> None:
         self.files.append(path)
 
+        track_name, events = file_cache.load(path, self._parse)
+
+        self.track_names[_get_track_tag(path)] = track_name
+        self.events += events
+        self._indexed_events = None
+
+    @staticmethod
+    def _parse(path: str) -> Tuple[str, List[Event]]:
         # Read file and parse events
         with open(path, "r") as f:
-            event_file = yaml.safe_load(f)
-
-        track = f"@{os.path.splitext(os.path.basename(path))[0]}"
-        self.track_names[track] = event_file["name"]
+            event_file = yaml.load(f, Loader=_YamlLoader)
 
+        track_tag = _get_track_tag(path)
         last_date = None
         events = []
         try:
             for e in event_file["events"]:
-                event = Event(e, path, last_date)
+                event = Event(e, path, last_date, track_tag)
                 events.append(event)
                 last_date = event.time.getEndTime()
         except Exception as e:
             print(f"== Error when loading events file {path} ==")
             raise e
 
-        self.events += events
+        return event_file["name"], events
+
+    def _ensure_index(self) -> None:
+        # events is public, rebuild if it was replaced or resized since
+        if self._indexed_events is not self.events or \
+                len(self._start_ords) != len(self.events):
+            self._build_index()
+
+    def _build_index(self) -> None:
+        self._indexed_events = self.events
+        self._by_tag = defaultdict(list)
+        for i, e in enumerate(self.events):
+            for tag in e._tag_set:
+                self._by_tag[tag].append(i)
+
+        # Day ordinals of each event, to check date bounds in bulk
+        self._start_ords = np.fromiter(
+            (e.time.getStartTime().toordinal() for e in self.events),
+            dtype=np.int64, count=len(self.events))
+        self._end_ords = np.fromiter(
+            (e.time.getEndTime().toordinal() for e in self.events),
+            dtype=np.int64, count=len(self.events))
+        # Only __str__ needs the start order, it sorts on first use
+        self._by_start = None
+
+    def _tag_candidates(self, filter: FilterCond) -> Optional[Set[int]]:
+        # Indices of events that may satisfy the filter, None if all may
+        if not filter.conds:
+            return None
+        candidates = set()
+        for cond in filter.conds:
+            tags = [tag for neg, tag in cond if not neg]
+            if not tags:
+                return None
+            # An event needs every positive tag, so the rarest one bounds it
+            candidates.update(min((self._by_tag.get(t, []) for t in tags),
+                                  key=len))
+        return candidates
 
     def filter(self, filter: FilterCond = None, start: datetime.date = None,
                end: datetime.date = None) -> List[Event]:
-        events = self.events
+        self._ensure_index()
 
+        indices = None
         if filter:
-            events = [e for e in events if filter.filter(e.tags)]
+            indices = self._tag_candidates(filter)
 
         assert (start is None) == (end is None)
         if start is not None and end is not None:
-            events = [e for e in events if e.time.date_in_bound(start, end)]
+            assert start < end
+            in_bound = np.flatnonzero(
+                (self._start_ords < end.toordinal()) &
+                (self._end_ords >= start.toordinal())).tolist()
+            if indices is None:
+                indices = in_bound
+            else:
+                indices = indices.intersection(in_bound)
+
+        if indices is None:
+            events = self.events
+        else:
+            events = [self.events[i] for i in sorted(indices)]
+
+        if filter:
+            events = [e for e in events if filter.filter(e._tag_set)]
         return events
 
     def __str__(self) -> str:
-        sorted_events = sorted(
-            self.events, key=lambda e: e.time.getStartTime())
-        return "\n".join([str(e) for e in sorted_events])
+        self._ensure_index()
+        if self._by_start is None:
+            self._by_start = sorted(
+                range(len(self.events)),
+                key=lambda i: self.events[i].time.getStartTime())
+        return "\n".join([str(self.events[i]) for i in self._by_start])
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -0,0 +1,72 @@
+import datetime
+import glob
+import hashlib
+import os
+import pickle
+from typing import Any, Callable
+
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "timeline")
+
+# Set TIMELINE_NO_CACHE (or pass --no-cache) to always parse from scratch
+enabled = not os.environ.get("TIMELINE_NO_CACHE")
+
+_source_stamp = None
+
+
+def _get_source_stamp() -> tuple:
+    # Parsed objects are pickled, so any change to the code invalidates them
+    global _source_stamp
+    if _source_stamp is None:
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        _source_stamp = tuple(
+            (os.path.basename(f), os.stat(f).st_mtime_ns)
+            for f in sorted(glob.glob(os.path.join(src_dir, "*.py"))))
+    return _source_stamp
+
+
+def _cache_key(path: str) -> tuple:
+    st = os.stat(path)
+    # Parsed objects keep the path they were loaded with, and relative dates
+    # are resolved against today, so both are part of the key
+    return (path, st.st_mtime_ns, st.st_size, datetime.date.today(),
+            _get_source_stamp())
+
+
+def _cache_file(path: str) -> str:
+    # One file per source path, a stale entry is overwritten by the next load
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f"{digest}.pkl")
+
+
+def load(path: str, parse: Callable[[str], Any]) -> Any:
+    # Return parse(path), reusing the pickled result while the file is unchanged
+    if not enabled:
+        return parse(path)
+
+    key = _cache_key(path)
+    cache_file = _cache_file(path)
+    try:
+        with open(cache_file, "rb") as f:
+            cached_key, result = pickle.load(f)
+        if cached_key == key:
+            return result
+    except Exception:
+        pass
+
+    result = parse(path)
+
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_file, "wb") as f:
+            pickle.dump((key, result), f)
+        os.replace(tmp_file, cache_file)
+    except Exception:
+        # Caching is best effort, the parsed result is returned regardless
+        try:
+            os.unlink(tmp_file)
+        except OSError:
+            pass
+    return result
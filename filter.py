@@ -1,10 +1,14 @@
-from typing import List
+from typing import FrozenSet, List, Tuple
 import re
 
+_COND_RE = re.compile(r"(!)?([#@])?(.*)")
+
 
 class FilterCond:
-    # Disconjuntive normal form
-    conds: List[List[str]]
+    # Disconjuntive normal form, each literal as (negated, tag)
+    conds: List[List[Tuple[bool, str]]]
+
+    __slots__ = ("conds", "_cond_sets")
 
     def __init__(self, conds: List[List[str]]) -> None:
         if conds is None:
@@ -13,46 +17,46 @@ class FilterCond:
         self._normalize_conds()
 
     @classmethod
-    def _normalize_cond(cls, cond: str) -> str:
-        m = re.match("(!)?([#@])?(.*)", cond)
+    def _normalize_cond(cls, cond: str) -> Tuple[bool, str]:
+        m = _COND_RE.match(cond)
         assert m, f"Cannot recognize filter condition {cond}"
 
         neg, t, tag = m.groups()
-        neg = "" if neg is None else neg
         t = "#" if t is None else t
         assert tag, f"No tag specified in filter condition {cond}"
 
-        new_cond = neg + t + tag
-        return new_cond
+        return neg is not None, t + tag
 
     def _normalize_conds(self) -> None:
         self.conds = [
             [self._normalize_cond(tag) for tag in cond]
             for cond in self.conds]
+        # (required tags, forbidden tags) of each conjunction
+        self._cond_sets = [
+            (frozenset(tag for neg, tag in cond if not neg),
+             frozenset(tag for neg, tag in cond if neg))
+            for cond in self.conds]
 
     def __str__(self) -> str:
-        ands = ["(" + "/\\".join(c) + ")" for c in self.conds]
+        ands = ["(" + "/\\".join(("!" if neg else "") + tag for neg, tag in c) + ")"
+                for c in self.conds]
         return " \/ ".join(ands)
 
     def __repr__(self) -> str:
         return self.__str__()
 
     @classmethod
-    def _filter_cond(cls, cond: List[str], tags: List[str]) -> bool:
-        for c in cond:
-            neg, tag = False, c
-            if c[0] == "!":
-                neg, tag = True, c[1:]
-
-            if (tag in tags) == neg:
-                return False
-
-        return True
+    def _filter_cond(cls, cond: Tuple[FrozenSet[str], FrozenSet[str]],
+                     tags: FrozenSet[str]) -> bool:
+        required, forbidden = cond
+        return required <= tags and forbidden.isdisjoint(tags)
 
     def filter(self, tags: List[str]) -> bool:
         if not self.conds:
             return True
-        for cond in self.conds:
+        if not isinstance(tags, (set, frozenset)):
+            tags = frozenset(tags)
+        for cond in self._cond_sets:
             if self._filter_cond(cond, tags):
                 return True
         return False
@@ -0,0 +1,470 @@
+import datetime
+from event import Event
+from config import Config
+import os
+from collections import defaultdict
+import matplotlib
+from matplotlib.artist import Artist
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PatchCollection
+from matplotlib.figure import Figure
+from matplotlib.text import Text
+from matplotlib.patches import Rectangle
+from matplotlib.transforms import Bbox
+import numpy as np
+from typing import Any, List, Optional, Tuple, Dict
+import functools
+import math
+import textwrap
+import date_utils
+
+
+@functools.lru_cache(maxsize=None)
+def _get_measure_canvas(dpi: float) -> FigureCanvasAgg:
+    return FigureCanvasAgg(Figure(dpi=dpi))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_measure_probe(text_style: Tuple[Tuple[str, Any], ...],
+                       dpi: float) -> Text:
+    # Off-screen text reused by every measurement with this style, it is
+    # never added to an axes so it is never drawn
+    probe = Text(0, 0, "", **dict(text_style))
+    probe.set_figure(_get_measure_canvas(dpi).figure)
+    return probe
+
+
+@functools.lru_cache(maxsize=16384)
+def _measure_text(text: str, text_style: Tuple[Tuple[str, Any], ...],
+                  fontsize: float, dpi: float) -> Tuple[float, float]:
+    # Pixel width and height of text, shared by all timelines with this dpi
+    probe = _get_measure_probe(text_style, dpi)
+    probe.set_text(text)
+    probe.set_fontsize(fontsize)
+    extent = probe.get_window_extent(
+        renderer=_get_measure_canvas(dpi).get_renderer())
+    return extent.width, extent.height
+
+
+@functools.lru_cache(maxsize=2048)
+def _wrap_layouts(text: str, maxline: int) -> Tuple[str, ...]:
+    # Distinct wrappings of text in at most maxline lines, fewest lines first
+    words = textwrap.wrap(text, width=1, break_long_words=False)
+    if not words:
+        # Only whitespace, there is nothing to wrap
+        return ()
+    layouts = []
+    last_layout = text
+    min_width = min(len(word) for word in words)
+    for line_width in range(len(text), min_width - 1, -1):
+        lines = textwrap.wrap(text, width=line_width, break_long_words=False)
+        if len(lines) > maxline:
+            break
+        layout = "\n".join(lines)
+        if layout != last_layout:
+            layouts.append(layout)
+            last_layout = layout
+    return tuple(layouts)
+
+
+class _TextGroup(Artist):
+    # Labels sharing one style and fontsize, drawn by a single reused Text
+    # instead of an artist per label
+    zorder = 3
+
+    def __init__(self, labels: List[Tuple[float, float, str]],
+                 text_style: Tuple[Tuple[str, Any], ...],
+                 fontsize: float) -> None:
+        super().__init__()
+        self.labels = labels
+        # Like the texts of Axes.text, labels are not clipped to the axes
+        self.set_clip_on(False)
+        self._probe = Text(0, 0, "", clip_on=False, **dict(text_style))
+        self._probe.set_fontsize(fontsize)
+
+    def set_figure(self, fig: Figure) -> None:
+        super().set_figure(fig)
+        self._probe.set_figure(fig)
+
+    def set_transform(self, t) -> None:
+        super().set_transform(t)
+        self._probe.set_transform(t)
+
+    def _iter_texts(self):
+        for x, y, text in self.labels:
+            self._probe.set_position((x, y))
+            self._probe.set_text(text)
+            yield self._probe
+
+    def draw(self, renderer) -> None:
+        if not self.get_visible():
+            return
+        for text in self._iter_texts():
+            text.draw(renderer)
+        self.stale = False
+
+    def get_window_extent(self, renderer=None) -> Bbox:
+        return Bbox.union([text.get_window_extent(renderer)
+                           for text in self._iter_texts()])
+
+
+class Timeline:
+    fig: Figure
+    config: Config
+    events: List[Event]
+
+    track_colors = ["#dbacac", "#a2c9aa", "#909eb4", "#b06262", "#f8c758",
+                    "#bdeff6", "#5ec6ec", "#70d4c0", "#9d725e"]
+
+    default_date_vline_style = {"color": "red", "linewidth": 3}
+    default_date_text_style = {"color": "red", "ha": "center", "va": "bottom",
+                          "fontsize": 18}
+    default_box_text_style = {"ha": "center", "va": "center"}
+
+    def __init__(self, config: Config, fig: Figure = None) -> None:
+        # fig is an optional figure of the same size to clear and draw on, e.g.
+        # the one of a timeline that has already been dumped
+        self.fig = fig
+        self.ax = None
+        self.config = config
+
+        if hasattr(self.config, "width") and hasattr(self.config, "height"):
+            self.width = self.config.width
+            self.height = self.config.height
+        else:
+            self.width, self.height = 16, 9
+        self.Xmin = 0
+        self.Ymin = 0
+        self.Xmax = self.Xmin + self.width
+        self.Ymax = self.Ymin + self.height
+        if self.fig is not None:
+            assert tuple(self.fig.get_size_inches()) == (self.width, self.height)
+
+        # Dates map to x through plain ordinal arithmetic
+        self._start_ord = self.config.start.toordinal()
+        self._end_ord = self.config.end.toordinal()
+        self._date_scale = self.width / (self._end_ord - self._start_ord)
+
+    def set_events(self, events: List[Event]) -> None:
+        self.events = events
+        tags = set(
+            tag for e in self.events for tag in e.tags if e.time.isPeriod())
+        self.tracks = sorted(tag for tag in tags if tag.startswith("@"))
+        self.track_cnt = len(self.tracks)
+        self._track_index = {t: i for i, t in enumerate(self.tracks)}
+        self._build_event_arrays()
+        self._draw_init()
+
+    def _build_event_arrays(self) -> None:
+        # One flat array per event attribute, so drawing never touches Events
+        events = self.events
+        self._names = [e.name for e in events]
+        self._is_period = np.fromiter(
+            (e.time.isPeriod() for e in events), dtype=bool, count=len(events))
+        # Date events have no track
+        self._track_nums = np.array(
+            [self._track_index[e.get_track()] if is_period else -1
+             for e, is_period in zip(events, self._is_period.tolist())],
+            dtype=np.int32)
+
+        # x of every event's start and end, periods are clipped to the config
+        # range while dates are drawn where they are
+        starts = np.fromiter(
+            (e.time.getStartTime().toordinal() for e in events),
+            dtype=np.int64, count=len(events))
+        ends = np.fromiter(
+            (e.time.getEndTime().toordinal() for e in events),
+            dtype=np.int64, count=len(events))
+        starts = np.where(self._is_period,
+                          np.clip(starts, self._start_ord, self._end_ord),
+                          starts)
+        ends = np.where(self._is_period,
+                        np.clip(ends, self._start_ord, self._end_ord), ends)
+        self._start_xs = self._get_ordinal_xs(starts)
+        self._end_xs = self._get_ordinal_xs(ends)
+
+    def _get_ordinal_xs(self, ords: np.ndarray) -> np.ndarray:
+        # Vectorized _get_date_x over date ordinals
+        return (ords - self._start_ord) * self._date_scale + self.Xmin
+
+    def _draw_init(self) -> None:
+        if self.fig is None:
+            self.fig = Figure(figsize=(self.width, self.height))
+            FigureCanvasAgg(self.fig)
+        self.fig.clear()
+        self.ax = self.fig.add_subplot()
+        self.ax.set_xlim((self.Xmin, self.Xmax + 0.01))  # TODO
+        self.ax.set_ylim((self.Ymin, self.Ymax))
+        self.ax.set_axis_off()
+        self.fig.tight_layout()
+
+        self.caption_padding = 0.1
+        self.legend_padding = 0.15
+        self.timeline_height = 1 - self.caption_padding - self.legend_padding
+        self.track_height = min(self.timeline_height /
+                                (self.track_cnt if self.track_cnt else 1), 0.15)
+
+        by_y = self.Ymin + self.legend_padding * self.height
+        bg_height = self.height * \
+            (1 - self.legend_padding - self.caption_padding)
+        rect = Rectangle((self.Xmin, by_y), self.width, bg_height,
+                         fill=False, ls="--", linewidth=1, edgecolor="grey")
+        self.ax.add_patch(rect)
+
+        # Top and bottom of every track's boxes
+        self._track_ys = self._get_track_y(np.arange(self.track_cnt))
+        self._track_bottom = self._track_ys - self.track_height * self.height
+
+        # Stable for the lifetime of the figure, used by every measurement
+        self._renderer = self.fig.canvas.get_renderer()
+        self._inv_trans = self.ax.transData.inverted()
+
+    def _get_track_y(self, track_num: int) -> float:
+        return (1 - (self.caption_padding + self.track_height * track_num)) * \
+            self.height + self.Ymin
+
+    def _get_date_x(self, date: datetime.date) -> float:
+        return (date.toordinal() - self._start_ord) * self._date_scale + \
+            self.Xmin
+
+    def _get_cached_extent(self, text: str, text_style: tuple,
+                           fontsize: float) -> Tuple[float, float]:
+        # Extent of text in data coordinates, without creating an artist
+        width, height = _measure_text(text, text_style, fontsize, self.fig.dpi)
+        extent = Bbox.from_bounds(0, 0, width, height).transformed(
+            self._inv_trans)
+        return extent.width, extent.height
+
+    def _fit_fontsize(self, text: str, text_style: tuple, width: float,
+                      height: float, max_fontsize: float) -> float:
+        # Largest fontsize, stepping down from max_fontsize, that fits the box
+        def fits(fontsize: float) -> bool:
+            text_width, text_height = self._get_cached_extent(
+                text, text_style, fontsize)
+            return text_width <= width and text_height <= height
+
+        text_width, text_height = self._get_cached_extent(
+            text, text_style, max_fontsize)
+        if text_width <= width and text_height <= height:
+            return max_fontsize
+
+        # Extents grow about linearly with fontsize, so jump to the estimate
+        # and only correct for pixel rounding, an empty extent always fits
+        scale = min(width / text_width if text_width else 1,
+                    height / text_height if text_height else 1)
+        fontsize = max_fontsize - max(1, math.ceil(max_fontsize * (1 - scale)))
+        while fontsize > 0 and not fits(fontsize):
+            fontsize -= 1
+        while fontsize + 1 < max_fontsize and fits(fontsize + 1):
+            fontsize += 1
+        return max(fontsize, 0)
+
+    @staticmethod
+    def _get_text_layouts(text: str, maxline: int):
+        # The text as is, then wrapped to more and more lines
+        yield text
+        if maxline > 1:
+            yield from _wrap_layouts(text, maxline)
+
+    def _fit_text_in_box(self, text: str, width: float, height: float,
+                         maxline: int, max_fontsize: float,
+                         text_style: tuple) -> Tuple[str, float]:
+        # Layout and fontsize of text, falling back to size 1 if nothing fits
+        fontsize, fitted_text = 0, None
+        for layout in self._get_text_layouts(text, maxline):
+            layout_fontsize = self._fit_fontsize(layout, text_style, width,
+                                                 height, max_fontsize)
+            # Prefer the unwrapped text, then the fewest lines, on ties
+            if layout_fontsize > fontsize:
+                fontsize, fitted_text = layout_fontsize, layout
+                if fontsize == max_fontsize:
+                    break
+
+        if fitted_text is None:
+            return text, 1
+        return fitted_text, fontsize
+
+    def _draw_text_in_box(self, text: str, center_x: float, center_y: float,
+                         width: float, height: float, maxline: int = 3,
+                         max_fontsize: float = 18, text_style: dict = None,
+                         clip: bool = False,
+                         labels: list = None) -> Optional[Text]:
+        if text_style is None:
+            text_style = {}
+        text_style = {**self.default_box_text_style, **text_style}
+        style_key = tuple(sorted(text_style.items()))
+
+        fitted_text, fontsize = self._fit_text_in_box(
+            text, width, height, maxline, max_fontsize, style_key)
+
+        if clip:
+            # Skip centered texts that would stick out of the canvas
+            text_width, _ = self._get_cached_extent(
+                fitted_text, style_key, fontsize)
+            if center_x - text_width / 2 < self.Xmin or \
+                    center_x + text_width / 2 > self.Xmax:
+                return None
+
+        if labels is not None:
+            # The caller draws them all at once, grouped by style and size
+            labels.append((style_key, fontsize, center_x, center_y,
+                           fitted_text))
+            return None
+
+        # Only create the artist once the layout is decided
+        txt = self.ax.text(center_x, center_y, fitted_text, **text_style)
+        txt.set_fontsize(fontsize)
+        return txt
+
+    def _draw_box_text_impl(self, text: str, left: float, bottom: float,
+                            width: float, height: float, color,
+                            patches: List[Rectangle] = None,
+                            labels: list = None):
+        rect = Rectangle((left, bottom), width, height, facecolor=color,
+                         linewidth=1, edgecolor="#1e2725")
+        if patches is None:
+            self.ax.add_patch(rect)
+        else:
+            # The caller adds them all at once as a collection
+            patches.append(rect)
+
+        txt = None
+        if text is not None:
+            txt = self._draw_text_in_box(text, left+width/2, bottom+(height)/2,
+                                         width*.95, height*.95, labels=labels)
+
+        return rect, txt
+
+    def _draw_event_period(
+            self, idx: int, patches: List[Rectangle] = None,
+            labels: list = None) -> Tuple[Rectangle, Optional[Text]]:
+        track_num = self._track_nums[idx]
+        color = self.track_colors[track_num]
+
+        left = self._start_xs[idx]
+        top = self._track_ys[track_num]
+        bottom = self._track_bottom[track_num]
+        width = self._end_xs[idx] - left
+        height = top - bottom
+
+        return self._draw_box_text_impl(self._names[idx], left, bottom, width,
+                                        height, color, patches, labels)
+
+    def _draw_date_impl(self, text: str, x: float, text_y_offset: float = 0.05,
+                        ymin: float = None, ymax: float = None,
+                        vline_style: dict = None, text_style: dict = None,
+                        clip_text: bool = False):
+        if ymin is None:
+            ymin = self.legend_padding
+        if ymax is None:
+            ymax = 1 - self.caption_padding
+
+        if vline_style is None:
+            vline_style = {}
+        vline_style = {**self.default_date_vline_style, **vline_style}
+
+        if text_style is None:
+            text_style = {}
+        text_style = {**self.default_date_text_style, **text_style}
+
+        vline = self.ax.axvline(x=x, ymin=ymin, ymax=ymax, **vline_style)
+        txt = self._draw_text_in_box(text, x, (ymax+text_y_offset)*self.height,
+                                     2, 1, text_style=text_style, maxline=2,
+                                     clip=clip_text)
+
+        return vline, txt
+
+    def _draw_event_date(self, idx: int) -> None:
+        self._draw_date_impl(self._names[idx], self._start_xs[idx])
+
+    def draw_events(self) -> None:
+        boxes = []
+        labels = []
+        for idx, is_period in enumerate(self._is_period.tolist()):
+            if is_period:
+                self._draw_event_period(idx, boxes, labels)
+            else:
+                self._draw_event_date(idx)
+
+        if boxes:
+            self.ax.add_collection(
+                PatchCollection(boxes, match_original=True), autolim=False)
+
+        groups = defaultdict(list)
+        for style_key, fontsize, x, y, text in labels:
+            groups[(style_key, fontsize)].append((x, y, text))
+        for (style_key, fontsize), group in groups.items():
+            self.ax.add_artist(_TextGroup(group, style_key, fontsize))
+
+    def draw_today(self, today: datetime.date = None) -> None:
+        if today is None:
+            today = getattr(self.config, "today", datetime.date.today())
+
+        if today < self.config.start or today > self.config.end:
+            return
+
+        x = self._get_date_x(today)
+        self._draw_date_impl("Today", x, 0.03)
+
+    def draw_grid(self, weekday: int = None, period: int = None) -> None:
+        if weekday is None:
+            weekday = getattr(self.config, "weekday", 0)
+
+        if period is None:
+            period = (self.config.end - self.config.start).days // 28
+            period = (2 ** (period.bit_length() - 1)) * 7
+            period = max(period, 7)
+
+        first = date_utils.next_weekday(
+            self.config.start - datetime.timedelta(days=1), weekday)
+        ords = np.arange(first.toordinal(), self._end_ord, period,
+                         dtype=np.int64)
+        xs = self._get_ordinal_xs(ords)
+
+        for date_ord, x in zip(ords.tolist(), xs):
+            date = datetime.date.fromordinal(date_ord)
+            self._draw_date_impl(
+                date.strftime("%b %d"), x, text_y_offset=0.01,
+                vline_style={"color": "grey",
+                             "linewidth": 1, "ls": "--", "zorder": 0},
+                text_style={"color": "grey", "fontsize": 16},
+                clip_text=True,
+            )
+
+    def draw_legend(self, track_names: Dict[str, str]) -> None:
+        if self.track_cnt == 0:
+            return
+
+        max_height = (self.legend_padding - 0.03) * self.height
+        max_width = 0.15 * self.width
+        ratio = 3  # width : height
+        padding = 0.03 * self.width
+        bottom = 0.01 * self.height + self.Ymin
+
+        width = (self.width - padding * (self.track_cnt + 1)) / self.track_cnt
+        width = min(max_width, width)
+        height = width / ratio
+        if height > max_height:
+            height = max_height
+            width = height * ratio
+
+        legend_width = padding * (self.track_cnt - 1) + width * self.track_cnt
+        center = self.Xmin + self.width / 2
+
+        for idx, track in enumerate(self.tracks):
+            left = center - legend_width / 2 + (padding + width) * idx
+            track_name = track_names[track]
+            color = self.track_colors[idx]
+            self._draw_box_text_impl(track_name, left, bottom, width, height,
+                                     color)
+
+    def dump(self, dir: str) -> None:
+        output_file = os.path.join(dir, self.config.filename)
+        _, ext = os.path.splitext(output_file)
+        if not ext:
+           output_file += ".png"
+        # Same crop as bbox_inches="tight", but measured with the cached
+        # renderer instead of a throwaway draw inside savefig
+        bbox = self.fig.get_tightbbox(self._renderer).padded(
+            matplotlib.rcParams["savefig.pad_inches"])
+        self.fig.savefig(output_file, bbox_inches=bbox)
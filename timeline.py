@@ -1,262 +1,18 @@
-import datetime
 from event import EventDB, Event
 from config import ConfigDB, Config
+import file_cache
 import os
-from matplotlib.figure import Figure
-from matplotlib.text import Text
-from matplotlib.patches import Rectangle
-import matplotlib.pyplot as plt
 from typing import List, Tuple, Dict
-import textwrap
-import date_utils
 import argparse
+import multiprocessing
 
 
-class Timeline:
-    fig: Figure
-    config: Config
-    events: List[Event]
-
-    track_colors = ["#dbacac", "#a2c9aa", "#909eb4", "#b06262", "#f8c758",
-                    "#bdeff6", "#5ec6ec", "#70d4c0", "#9d725e"]
-
-    default_date_vline_style = {"color": "red", "linewidth": 3}
-    default_date_text_style = {"color": "red", "ha": "center", "va": "bottom",
-                          "fontsize": 18}
-    default_box_text_style = {"ha": "center", "va": "center"}
-
-    def __init__(self, config: Config) -> None:
-        self.fig = None
-        self.config = config
-
-        if hasattr(self.config, "width") and hasattr(self.config, "height"):
-            self.width = self.config.width
-            self.height = self.config.height
-        else:
-            self.width, self.height = 16, 9
-        self.Xmin = 0
-        self.Ymin = 0
-        self.Xmax = self.Xmin + self.width
-        self.Ymax = self.Ymin + self.height
-
-    def __del__(self):
-        if self.fig:
-            plt.close(self.fig)
-            self.fig = None
-
-    def set_events(self, events: List[Event]) -> None:
-        self.events = events
-        tags = set(
-            tag for e in self.events for tag in e.tags if e.time.isPeriod())
-        self.tracks = sorted(tag for tag in tags if tag.startswith("@"))
-        self.track_cnt = len(self.tracks)
-        self._draw_init()
-
-    def _draw_init(self) -> None:
-        if self.fig:
-            plt.close(self.fig)
-        self.fig = plt.figure(figsize=(self.width, self.height))
-        plt.xlim((self.Xmin, self.Xmax + 0.01))  # TODO
-        plt.ylim((self.Ymin, self.Ymax))
-        plt.axis('off')
-        plt.tight_layout()
-
-        self.caption_padding = 0.1
-        self.legend_padding = 0.15
-        self.timeline_height = 1 - self.caption_padding - self.legend_padding
-        self.track_height = min(self.timeline_height /
-                                (self.track_cnt if self.track_cnt else 1), 0.15)
-
-        by_y = self.Ymin + self.legend_padding * self.height
-        bg_height = self.height * \
-            (1 - self.legend_padding - self.caption_padding)
-        rect = plt.Rectangle((self.Xmin, by_y), self.width, bg_height,
-                             fill=False, ls="--", linewidth=1, edgecolor="grey")
-        plt.gca().add_patch(rect)
-
-    def _get_track_y(self, track_num: int) -> float:
-        return (1 - (self.caption_padding + self.track_height * track_num)) * \
-            self.height + self.Ymin
-
-    def _get_date_x(self, date: datetime.date) -> float:
-        return (date - self.config.start) / \
-            (self.config.end - self.config.start) * \
-            self.width + self.Xmin
-
-    def _get_text_extent(self, text):
-        renderer = self.fig.canvas.get_renderer()
-        extent = text.get_window_extent(renderer=renderer)
-        transformed_bbox = extent.transformed(
-            self.fig.gca().transData.inverted())
-        return transformed_bbox
-
-    def _draw_text_in_box(self, text: str, center_x: float, center_y: float,
-                         width: float, height: float, maxline: int = 3,
-                         max_fontsize: float = 18, text_style: dict = None) -> Text:
-        if text_style is None:
-            text_style = {}
-        text_style = {**self.default_box_text_style, **text_style}
-
-        fontsize = max_fontsize
-        txt = plt.text(center_x, center_y, text, **text_style)
-        while fontsize > 0:
-            txt.set_fontsize(fontsize)
-            extent = self._get_text_extent(txt)
-            text_width, text_height = extent.width, extent.height
-            if text_width <= width and text_height <= height:
-                return txt
-
-            # Try to wrap the text
-            if maxline > 1 and text_width > width and text_height <= height:
-                line_width = len(text)
-                min_width = min(len(line) for line in textwrap.wrap(
-                    text, width=1, break_long_words=False))
-                while line_width >= min_width and text_height <= height:
-                    lines = textwrap.wrap(text, width=line_width, break_long_words=False)
-                    txt.set_text("\n".join(lines))
-                    extent = self._get_text_extent(txt)
-                    text_width, text_height = extent.width, extent.height
-                    if text_width <= width and text_height <= height and len(lines) <= maxline:
-                        return txt
-                    line_width -= 1
-                txt.set_text(text)
-
-            fontsize -= 1
-
-    def _draw_box_text_impl(self, text: str, left: float, bottom: float,
-                            width: float, height: float, color):
-        rect = plt.Rectangle((left, bottom), width, height, facecolor=color,
-                             linewidth=1, edgecolor="#1e2725")
-        plt.gca().add_patch(rect)
-
-        if text is not None:
-            txt = self._draw_text_in_box(text, left+width/2, bottom+(height)/2,
-                                         width*.95, height*.95)
-
-        return rect, txt
-
-    def _draw_event_period(self, event: Event) -> Tuple[Rectangle, Text]:
-        start, end = event.time.date_intersection(self.config.start,
-                                                  self.config.end)
-        track_num = self.tracks.index(event.get_track())
-        color = self.track_colors[track_num]
-
-        left = self._get_date_x(start)
-        right = self._get_date_x(end)
-        top = self._get_track_y(track_num)
-        bottom = top - self.track_height * self.height
-        width = right - left
-        height = top - bottom
-
-        return self._draw_box_text_impl(event.name, left, bottom, width, height,
-                                        color)
-
-    def _draw_date_impl(self, text: str, x: float, text_y_offset: float = 0.05,
-                        ymin: float = None, ymax: float = None,
-                        vline_style: dict = None, text_style: dict = None):
-        if ymin is None:
-            ymin = self.legend_padding
-        if ymax is None:
-            ymax = 1 - self.caption_padding
-
-        if vline_style is None:
-            vline_style = {}
-        vline_style = {**self.default_date_vline_style, **vline_style}
-
-        if text_style is None:
-            text_style = {}
-        text_style = {**self.default_date_text_style, **text_style}
-
-        vline = plt.axvline(x=x, ymin=ymin, ymax=ymax, **vline_style)
-        txt = self._draw_text_in_box(text, x, (ymax+text_y_offset)*self.height,
-                                     2, 1, text_style=text_style, maxline=2)
-
-        return vline, txt
-
-    def _draw_event_date(self, event: Event) -> None:
-        x = self._get_date_x(event.time.date)
-        self._draw_date_impl(event.name, x)
-
-    def draw_events(self) -> None:
-        for event in self.events:
-            if event.time.isPeriod():
-                self._draw_event_period(event)
-            else:
-                self._draw_event_date(event)
-
-    def draw_today(self, today: datetime.date = None) -> None:
-        if today is None:
-            today = getattr(self.config, "today", datetime.date.today())
-
-        if today < self.config.start or today > self.config.end:
-            return
-
-        x = self._get_date_x(today)
-        self._draw_date_impl("Today", x, 0.03)
-
-    def draw_grid(self, weekday: int = None, period: int = None) -> None:
-        if weekday is None:
-            weekday = getattr(self.config, "weekday", 0)
-
-        if period is None:
-            period = (self.config.end - self.config.start).days // 28
-            period = (2 ** (period.bit_length() - 1)) * 7
-            period = max(period, 7)
-
-        date = date_utils.next_weekday(
-            self.config.start - datetime.timedelta(days=1), weekday)
-
-        while date < self.config.end:
-            x = self._get_date_x(date)
-            _, txt = self._draw_date_impl(
-                date.strftime("%b %d"), x, text_y_offset=0.01,
-                vline_style={"color": "grey",
-                             "linewidth": 1, "ls": "--", "zorder": 0},
-                text_style={"color": "grey", "fontsize": 16},
-            )
-
-            extent = self._get_text_extent(txt)
-            text_width, _ = extent.width, extent.height
-            text_x, _ = txt.get_position()
-            if text_x - text_width / 2 < self.Xmin or \
-                    text_x + text_width / 2 > self.Xmax:
-                txt.remove()
-
-            date += datetime.timedelta(days=period)
-
-    def draw_legend(self, track_names: Dict[str, str]) -> None:
-        if self.track_cnt == 0:
-            return
-
-        max_height = (self.legend_padding - 0.03) * self.height
-        max_width = 0.15 * self.width
-        ratio = 3  # width : height
-        padding = 0.03 * self.width
-        bottom = 0.01 * self.height + self.Ymin
-
-        width = (self.width - padding * (self.track_cnt + 1)) / self.track_cnt
-        width = min(max_width, width)
-        height = width / ratio
-        if height > max_height:
-            height = max_height
-            width = height * ratio
-
-        legend_width = padding * (self.track_cnt - 1) + width * self.track_cnt
-        center = self.Xmin + self.width / 2
-
-        for idx, track in enumerate(self.tracks):
-            left = center - legend_width / 2 + (padding + width) * idx
-            track_name = track_names[track]
-            color = self.track_colors[idx]
-            self._draw_box_text_impl(track_name, left, bottom, width, height,
-                                     color)
-
-    def dump(self, dir: str) -> None:
-        output_file = os.path.join(dir, self.config.filename)
-        _, ext = os.path.splitext(output_file)
-        if not ext:
-           output_file += ".png"
-        plt.savefig(output_file, bbox_inches="tight")
+def __getattr__(name: str):
+    # Timeline pulls in matplotlib, which is only imported once it is used
+    if name == "Timeline":
+        from render import Timeline
+        return Timeline
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def parse_args():
@@ -265,16 +21,50 @@ def parse_args():
     parser.add_argument("--configs", type=str,
                         help="path to the config file, or dir of configs")
     parser.add_argument("--out", type=str, help="output dir")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="do not read or write the parsed file cache")
     parser.add_argument("working_dir", nargs="?", type=str, default=".")
     opt = parser.parse_args()
     return opt
 
 
+# Figures of timelines already dumped by this process, by size, reused by the
+# next timeline of the same size
+_figures = {}
+
+
+def _render_config(
+        job: Tuple[Config, List[Event], Dict[str, str], str]) -> None:
+    # Imported here so that workers, not the parent, pay for matplotlib
+    from render import Timeline
+
+    config, events, track_names, out_dir = job
+    size = (getattr(config, "width", None), getattr(config, "height", None))
+    try:
+        timeline = Timeline(config, _figures.get(size))
+        timeline.set_events(events)
+        timeline.draw_events()
+        timeline.draw_today()
+        timeline.draw_grid()
+        timeline.draw_legend(track_names)
+
+        config_out = os.path.join(out_dir, os.path.basename(config.path))
+        # Configs from the same file may be rendered concurrently
+        os.makedirs(config_out, exist_ok=True)
+        timeline.dump(config_out)
+        _figures[size] = timeline.fig
+    except Exception as e:
+        print(f"Error with config: {config.name} defined in {config.path}")
+        raise e
+
+
 def main():
     eventDB = EventDB()
     configDB = ConfigDB()
 
     opt = parse_args()
+    if opt.no_cache:
+        file_cache.enabled = False
 
     if opt.configs is not None:
         config_dir = opt.configs
@@ -293,31 +83,33 @@ def main():
     if not os.path.isdir(out_dir):
         os.mkdir(out_dir)
 
-    for file in os.listdir(config_dir):
-        if file.endswith(".yaml") or file.endswith(".yml"):
-            configDB.load(os.path.join(config_dir, file))
+    with os.scandir(config_dir) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith((".yaml", ".yml")):
+                configDB.load(entry.path)
 
-    for file in os.listdir(event_dir):
-        if file.endswith(".yaml") or file.endswith(".yml"):
-            eventDB.load(os.path.join(event_dir, file))
+    with os.scandir(event_dir) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith((".yaml", ".yml")):
+                eventDB.load(entry.path)
 
+    # Filter here so that workers only receive the events they draw
+    jobs = []
     for config in configDB.configs:
         try:
-            timeline = Timeline(config)
-            timeline.set_events(eventDB.filter(
-                config.filter, config.start, config.end))
-            timeline.draw_events()
-            timeline.draw_today()
-            timeline.draw_grid()
-            timeline.draw_legend(eventDB.track_names)
-
-            config_out = os.path.join(out_dir, os.path.basename(config.path))
-            if not os.path.isdir(config_out):
-                os.mkdir(config_out)
-            timeline.dump(config_out)
+            events = eventDB.filter(config.filter, config.start, config.end)
         except Exception as e:
             print(f"Error with config: {config.name} defined in {config.path}")
             raise e
+        jobs.append((config, events, eventDB.track_names, out_dir))
+
+    processes = min(len(jobs), os.cpu_count() or 1)
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            pool.map(_render_config, jobs, chunksize=1)
+    else:
+        for job in jobs:
+            _render_config(job)
 
 if __name__ == "__main__":
     main()